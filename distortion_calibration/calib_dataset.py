@@ -0,0 +1,141 @@
+import json
+import os
+
+import numpy as np
+
+# --- Calibration dataset container ---
+#
+# A dataset is a directory holding
+#   meta.json   - {"version": 1, "width": W, "height": H}
+#   images.u8   - raw GRAY8 frames of HxW bytes, back to back
+#   index.bin   - one INDEX_DTYPE record per frame (timestamp, sequence, eye)
+#
+# Frames are appended to images.u8 before their index record is written, so
+# the index always describes complete frames. A write that was interrupted
+# leaves trailing bytes behind, opening for writing cuts both files back to
+# the last complete frame. Reading memory-maps images.u8 and hands out
+# zero-copy views; there is no decoding and no JPEG loss.
+
+FORMAT_VERSION = 1
+
+INDEX_DTYPE = np.dtype([
+    ('timestamp_ns', '<u8'), # Device timestamp (TS1) of the frame; for side by side pairs
+                             # TS1 relative to the first pair (xrealultra2dec pts-from-frame)
+    ('seq', '<i4'),          # Sequence number from the frame header
+    ('eye', 'u1'),           # 0: left, 1: right, 2: both (side by side)
+    ('_pad', 'u1', 3),
+])
+
+EYE_LEFT = 0
+EYE_RIGHT = 1
+EYE_BOTH = 2
+
+
+class CalibrationDataset:
+    def __init__(self, path, width, height, writable=False):
+        self.path = path
+        self.width = width
+        self.height = height
+        self._writable = writable
+        self._images_file = None
+        self._index_file = None
+        self._images = None
+        self._index = None
+
+        if writable:
+            self._images_file = open(os.path.join(path, 'images.u8'), 'ab')
+            self._index_file = open(os.path.join(path, 'index.bin'), 'ab')
+            self._truncate()
+
+    def _truncate(self):
+        # Drop a partial index record and images without one
+        index_size = os.fstat(self._index_file.fileno()).st_size
+        count = index_size // INDEX_DTYPE.itemsize
+        self._index_file.truncate(count * INDEX_DTYPE.itemsize)
+        images_size = count * self.height * self.width
+        if os.fstat(self._images_file.fileno()).st_size > images_size:
+            self._images_file.truncate(images_size)
+
+    @classmethod
+    def create(cls, path, width, height):
+        """Open a dataset for appending, creating it if it does not exist yet."""
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            dataset = cls.open(path, writable=True)
+            if (dataset.width, dataset.height) != (width, height):
+                dataset.close()
+                raise ValueError(f"Dataset {path} holds {dataset.width}x{dataset.height} frames, not {width}x{height}")
+            return dataset
+
+        os.makedirs(path, exist_ok=True)
+        with open(meta_path, 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'width': width, 'height': height}, f)
+        return cls(path, width, height, writable=True)
+
+    @classmethod
+    def open(cls, path, writable=False):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset version {meta.get('version')} in {path}")
+        return cls(path, meta['width'], meta['height'], writable=writable)
+
+    def append(self, image, timestamp_ns=0, eye=EYE_LEFT, seq=0):
+        if not self._writable:
+            raise IOError(f"Dataset {self.path} is opened read-only")
+        if image.shape != (self.height, self.width) or image.dtype != np.uint8:
+            raise ValueError(f"Expected a {self.height}x{self.width} uint8 image, got {image.shape} {image.dtype}")
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['timestamp_ns'] = timestamp_ns
+        record['seq'] = seq
+        record['eye'] = eye
+
+        # Writes the image in C order even if we were handed a rotated view
+        self._images_file.write(np.ascontiguousarray(image).data)
+        self._images_file.flush()
+        self._index_file.write(record.tobytes())
+        self._index_file.flush()
+
+        # Invalidate the maps, they no longer cover the whole file
+        self._images = None
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = np.fromfile(os.path.join(self.path, 'index.bin'), dtype=INDEX_DTYPE)
+        return self._index
+
+    @property
+    def images(self):
+        """All frames as a (N, height, width) read-only memory map."""
+        if self._images is None:
+            count = len(self.index)
+            if count == 0:
+                self._images = np.zeros((0, self.height, self.width), dtype=np.uint8)
+            else:
+                self._images = np.memmap(os.path.join(self.path, 'images.u8'), dtype=np.uint8,
+                                         mode='r', shape=(count, self.height, self.width))
+        return self._images
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        return self.images[idx]
+
+    def select(self, eye=None):
+        """Indices of the frames of the given eye (all frames for None)."""
+        if eye is None:
+            return np.arange(len(self))
+        return np.flatnonzero(self.index['eye'] == eye)
+
+    def close(self):
+        if self._images_file is not None:
+            self._images_file.close()
+            self._index_file.close()
+            self._images_file = None
+            self._index_file = None
+        self._images = None
+        self._index = None
@@ -4,7 +4,9 @@ import time
 import sys
 import numpy as np
 import os # Added for path joining
-from PIL import Image # Added for image saving
+from calib_dataset import CalibrationDataset, EYE_LEFT, EYE_RIGHT
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'parts'))
+from trace_events import trace_from_env
 
 gi.require_version('Gst', '1.0')
 gi.require_version('Gtk', '4.0')
@@ -29,12 +31,19 @@ OUT_FORMAT = "GRAY8"
 last_photo_time = 0.0  # Initialize to 0.0, will be set on first frame processed
 photo_capture_interval = 5  # seconds
 photo_counter = 0
-# Output folder for calibration images (current directory)
-output_folder = "."
-# If you wanted a subfolder, you could do:
-# output_folder = "calibration_images"
-# if not os.path.exists(output_folder):
-#     os.makedirs(output_folder)
+# Every interval one frame of each eye is saved, distortion.py calibrates them
+# separately. Only the left eye is shown, right eye frames are skipped unless
+# one is due.
+pending_eyes = set()
+# Calibration frames are appended to this dataset (see calib_dataset.py),
+# distortion.py reads them back without any decoding. They are stored in the
+# rotation=2 orientation of xrealultra2dec.
+dataset_path = "calibration_dataset"
+dataset = CalibrationDataset.create(dataset_path, OUT_WIDTH, OUT_HEIGHT)
+
+# Set XREAL_TRACE=/path/trace.json to record the unscramble stages as a
+# Chrome trace, written on exit (see parts/trace_events.py)
+trace = trace_from_env('capture_unscrambled_feed')
 
 # --- Build Input Pipeline: avfvideosrc ! caps_cam_native ! queue ! appsink ---
 pipeline = Gst.Pipeline()
@@ -141,8 +150,9 @@ bus_out.connect("message", on_bus_message, "OutputPipe")
 
 def new_frame_unscramble(sink):
     global frame_count_unscrambled
-    global last_photo_time, photo_counter # Declare globals for photo capture
+    global last_photo_time, photo_counter, pending_eyes # Declare globals for photo capture
 
+    t = trace.begin()
     sample = sink.emit("pull-sample")
     if sample is None:
         return Gst.FlowReturn.OK
@@ -151,7 +161,9 @@ def new_frame_unscramble(sink):
     if gst_buffer is None:
         print("Unscramble: get_buffer returned None from sample")
         return Gst.FlowReturn.ERROR
+    trace.end('pull', t)
 
+    t = trace.begin()
     success, map_info = gst_buffer.map(Gst.MapFlags.READ)
     if not success:
         print("Unscramble: Failed to map buffer for reading")
@@ -169,11 +181,12 @@ def new_frame_unscramble(sink):
     gst_buffer.unmap(map_info)
 
     img_np_view = np.frombuffer(img_bytes_slice_data, dtype=np.uint8)
+    trace.end('map', t)
 
     try:
         if len(hdr_bytes_slice_data) < (0x30 + 12):
             return Gst.FlowReturn.OK
-        if hdr_bytes_slice_data[0x30 + 11] == 1: # Skip based on header byte
+        if hdr_bytes_slice_data[0x30 + 11] == 1 and EYE_RIGHT not in pending_eyes: # Skip based on header byte
             return Gst.FlowReturn.OK
     except (struct.error, IndexError) as e:
         return Gst.FlowReturn.OK # Or handle error
@@ -192,6 +205,7 @@ def new_frame_unscramble(sink):
             if first_frame_debug: print(f"Unscramble: img_np_view size mismatch for unscrambling.")
             # Don't return yet, let it go to the black image fallback for final_image_np
         else: # Only proceed with unscrambling if size is correct
+            t = trace.begin()
             marker = b'\0' * 128
             from_block_idx = 0
             try:
@@ -205,6 +219,9 @@ def new_frame_unscramble(sink):
                 if first_frame_debug: print(f"  Calculated from_block_idx {from_block_idx} is out of range. Defaulting to 0.")
                 from_block_idx = 0
 
+            trace.end('start-offset', t)
+
+            t = trace.begin()
             edge_pixels = []
             chain_options = [[] for _ in range(num_blocks_expected)]
 
@@ -258,6 +275,9 @@ def new_frame_unscramble(sink):
                 print(f"Unscramble Frame {frame_count_unscrambled}: bmap is full permutation: {is_permutation}, len(set): {len(set(bmap))}, len: {len(bmap)}")
                 if not is_permutation or len(bmap) < 20 : print(f"Unscramble Frame {frame_count_unscrambled}: Generated bmap (first 20): {bmap[:20]}")
 
+            trace.end('chain', t)
+
+            t = trace.begin()
             for target_block_idx in range(num_blocks_expected):
                 if target_block_idx >= len(bmap): continue # Should not happen if bmap filled
                 source_block_idx = bmap[target_block_idx]
@@ -271,6 +291,7 @@ def new_frame_unscramble(sink):
                 if (src_start + 2400 <= len(img_np_view)) and \
                    (tgt_start + 2400 <= len(img_new_unscrambled)):
                     img_new_unscrambled[tgt_start : tgt_start+2400] = img_np_view[src_start : src_start+2400]
+            trace.end('reorder', t)
 
     except Exception as e:
         print(f"Unscramble: Error during unscrambling algorithm: {e}")
@@ -279,13 +300,21 @@ def new_frame_unscramble(sink):
         # img_new_unscrambled will remain zeros or partially filled
 
     # --- Prepare final image (rotation, fallback to black if issues) ---
+    t = trace.begin()
     final_image_np = None # This will hold the np array of the final image (OUT_HEIGHT, OUT_WIDTH)
 
     # Check if unscrambled data seems valid enough for rotation
     if img_new_unscrambled.size == img_new_unscrambled_pre_rotation_rows * img_new_unscrambled_pre_rotation_cols:
         try:
             image_2d = img_new_unscrambled.reshape((img_new_unscrambled_pre_rotation_rows, img_new_unscrambled_pre_rotation_cols))
-            rotated_image_2d = np.rot90(image_2d, k=1) # k=1 for counter-clockwise
+            # Same orientation as "xrealultra2dec rotation=2", so the intrinsics
+            # from distortion.py fit the decoder output (and passthrough.py).
+            # The right eye is transposed (ul-lr), the left eye is flipped
+            # along the other diagonal (ur-ll). A plain rot90 would mirror it.
+            if hdr_bytes_slice_data[0x3b]:
+                rotated_image_2d = image_2d.T
+            else:
+                rotated_image_2d = image_2d[::-1, ::-1].T
             
             # Sanity check dimensions after rotation
             if rotated_image_2d.shape[0] == OUT_HEIGHT and rotated_image_2d.shape[1] == OUT_WIDTH:
@@ -307,29 +336,44 @@ def new_frame_unscramble(sink):
 
     # Convert the final NumPy array to bytes for GStreamer
     final_buffer_data_bytes = final_image_np.tobytes()
+    trace.end('rotate', t)
 
     # --- Photo Capture Logic ---
+    t = trace.begin()
     current_time = time.time()
     # Initialize last_photo_time on the very first successfully processed frame
     if last_photo_time == 0.0: 
         last_photo_time = current_time # Start timer from the first frame
 
     if (current_time - last_photo_time) >= photo_capture_interval:
+        pending_eyes = {EYE_LEFT, EYE_RIGHT}
+        last_photo_time = current_time # Reset timer for the next interval
+
+    eye = EYE_RIGHT if hdr_bytes_slice_data[0x3b] else EYE_LEFT
+    if eye in pending_eyes:
         photo_counter += 1
-        filename = os.path.join(output_folder, f"calibr_{photo_counter}.jpg")
         try:
             # final_image_np is a NumPy array with shape (OUT_HEIGHT, OUT_WIDTH)
-            # OUT_FORMAT is GRAY8, so it's a grayscale image.
-            pil_image = Image.fromarray(final_image_np, mode='L') # 'L' for 8-bit grayscale
-            pil_image.save(filename, "JPEG")
-            print(f"Saved photo: {filename}")
-            last_photo_time = current_time # Reset timer for the next interval
+            # OUT_FORMAT is GRAY8, stored as is (no JPEG artifacts).
+            timestamp_ns = struct.unpack('<Q', hdr_bytes_slice_data[0:8])[0]
+            seq = struct.unpack('<h', hdr_bytes_slice_data[18:20])[0]
+            dataset.append(final_image_np, timestamp_ns=timestamp_ns, eye=eye, seq=seq)
+            print(f"Saved photo {photo_counter} to {dataset_path} (frame {len(dataset) - 1}, eye {eye})")
+            pending_eyes.discard(eye)
         except Exception as e:
-            print(f"Error saving photo {filename}: {e}")
+            print(f"Error saving photo {photo_counter}: {e}")
+    trace.end('save', t)
     # --- End Photo Capture Logic ---
 
+    if eye == EYE_RIGHT:
+        # Not previewed, the output shows the left eye only
+        frame_count_unscrambled += 1
+        return Gst.FlowReturn.OK
+
+    t = trace.begin()
     out_g_buf = Gst.Buffer.new_wrapped(final_buffer_data_bytes)
     ret = outsrc.emit("push-buffer", out_g_buf)
+    trace.end('push', t)
 
     frame_count_unscrambled += 1
     return Gst.FlowReturn.OK
@@ -345,7 +389,7 @@ if outpipe.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
 print(f"Input pipeline delivering: {caps_cam_native_str} (size: {APPSINK_EXPECTED_BLOCKSIZE} bytes) -> appsink")
 print(f"Unscrambling, then rotating. Outputting as: {OUT_FORMAT}, {OUT_WIDTH}x{OUT_HEIGHT} (size: {OUT_WIDTH*OUT_HEIGHT} bytes)")
 print(f"Output pipeline displaying this via appsrc.")
-print(f"Photos will be saved as calibr_X.jpg every {photo_capture_interval} seconds in '{os.path.abspath(output_folder)}'.")
+print(f"One photo per eye will be appended every {photo_capture_interval} seconds to the dataset '{os.path.abspath(dataset_path)}'.")
 print("Starting main loop. Press Ctrl+C to exit.")
 
 mainloop = GLib.MainLoop()
@@ -361,4 +405,6 @@ finally:
     print("Setting pipelines to NULL state.")
     if pipeline: pipeline.set_state(Gst.State.NULL)
     if outpipe: outpipe.set_state(Gst.State.NULL)
+    dataset.close()
+    trace.dump()
     print("Exited.")
\ No newline at end of file
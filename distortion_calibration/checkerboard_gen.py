@@ -1,85 +1,222 @@
+import argparse
+import json
+
 import cv2
 import numpy as np
-import os
-
-# --- Parameters for the Checkerboard Pattern ---
-# These should match what cv2.findChessboardCorners expects
-# It's the number of INNER corners.
-# So, for a 7x10 grid of squares, you'll have 6x9 inner corners.
-PATTERN_SIZE_INTERNAL_CORNERS = (6, 9)  # (cols-1, rows-1) or (width-1, height-1)
-
-# Number of squares along width and height
-NUM_SQUARES_WIDTH = PATTERN_SIZE_INTERNAL_CORNERS[0] + 1
-NUM_SQUARES_HEIGHT = PATTERN_SIZE_INTERNAL_CORNERS[1] + 1
-
-# Size of each square in pixels in the output image
-SQUARE_SIZE_PIXELS = 100  # Adjust this for your desired output image size
-
-# Add a white border/margin around the checkerboard (in pixels)
-# This helps with corner detection, especially near the edges.
-MARGIN_PIXELS = SQUARE_SIZE_PIXELS // 2 # Or a fixed value like 50
-
-# Output image filename
-OUTPUT_FILENAME = "checkerboard_pattern.png"
-
-# --- Generate the Checkerboard Image ---
-
-# Calculate image dimensions
-img_width = NUM_SQUARES_WIDTH * SQUARE_SIZE_PIXELS + 2 * MARGIN_PIXELS
-img_height = NUM_SQUARES_HEIGHT * SQUARE_SIZE_PIXELS + 2 * MARGIN_PIXELS
-
-# Create a white image (255)
-# Use a grayscale image (1 channel) as color is not necessary for the pattern itself
-checkerboard_img = np.ones((img_height, img_width), dtype=np.uint8) * 255
-
-# Iterate over the squares and color them black or white
-for r_sq in range(NUM_SQUARES_HEIGHT):  # Row index of the square
-    for c_sq in range(NUM_SQUARES_WIDTH):  # Column index of the square
-        # Determine color: if (row_idx + col_idx) is even, it's one color, if odd, the other.
-        # Let's make (0,0) a black square for consistency (optional choice)
-        if (r_sq + c_sq) % 2 == 0:
-            color = 0  # Black
-        else:
-            color = 255 # White (already set, but explicit for black squares)
-
-        if color == 0: # Only draw black squares
-            # Calculate top-left corner of the current square
-            x1 = MARGIN_PIXELS + c_sq * SQUARE_SIZE_PIXELS
-            y1 = MARGIN_PIXELS + r_sq * SQUARE_SIZE_PIXELS
-
-            # Calculate bottom-right corner of the current square
-            x2 = x1 + SQUARE_SIZE_PIXELS
-            y2 = y1 + SQUARE_SIZE_PIXELS
-
-            # Draw the filled rectangle
-            cv2.rectangle(checkerboard_img, (x1, y1), (x2, y2), color, thickness=cv2.FILLED)
-
-# --- Save and Display ---
-cv2.imwrite(OUTPUT_FILENAME, checkerboard_img)
-print(f"Checkerboard pattern saved as {OUTPUT_FILENAME}")
-print(f"Pattern details:")
-print(f"  - Internal corners: {PATTERN_SIZE_INTERNAL_CORNERS}")
-print(f"  - Number of squares: ({NUM_SQUARES_WIDTH}W x {NUM_SQUARES_HEIGHT}H)")
-print(f"  - Square size in image: {SQUARE_SIZE_PIXELS}x{SQUARE_SIZE_PIXELS} pixels")
-print(f"  - Image dimensions: {img_width}x{img_height} pixels")
-
-# Display the generated pattern (optional)
-cv2.imshow("Generated Checkerboard", checkerboard_img)
-cv2.waitKey(0)
-cv2.destroyAllWindows()
-
-print("\n--- Instructions for Use ---")
-print(f"1. Print '{OUTPUT_FILENAME}' on a flat, rigid surface. Ensure high contrast and sharp edges.")
-print(f"   Alternatively, display it on a *flat* monitor (ensure no glare, full screen).")
-print(f"2. When printing, measure the *actual physical size* of one square (e.g., in mm or inches).")
-print(f"   This 'square_real_world_size' will be used to define 'objp' in your calibration script.")
-print(f"   For example, if your printed square is 2.5cm, then square_real_world_size = 25 (if using mm).")
-print(f"   Your 'objp' setup in the calibration script assumes a unit square size (e.g., 1.0).")
-print(f"   If you use that, the units of your rvecs/tvecs will be in 'square units'.")
-print(f"   To get real-world units, modify objp: ")
-print(f"     `objp[0,:,:2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2) * square_real_world_size`")
-print(f"3. Take multiple pictures of this checkerboard with your fisheye camera from various angles and distances,")
-print(f"   ensuring the entire board is visible and fills a good portion of the frame.")
-print(f"4. Save these images (e.g., as 'calibration_image_01.jpg', 'calibration_image_02.jpg', etc.) in the")
-print(f"   same directory as your calibration script, or update the `glob.glob('*.jpg')` path.")
-print(f"5. Run your calibration script (the one you provided in the question).")
\ No newline at end of file
+
+# --- Calibration target generator ---
+#
+#   python3 checkerboard_gen.py                                   # plain 7x10 checkerboard
+#   python3 checkerboard_gen.py --type charuco --square-mm 30 --marker-mm 22 --dpi 300
+#
+# Boards are rendered with array operations only (no per-square drawing) at a
+# given physical square size and print resolution. Next to the image a board
+# definition (board.json by default) is written; corners.py picks it up so
+# distortion.py and stereo_calibration.py detect exactly this board.
+#
+# A ChArUco board carries an ArUco marker in every white square, so corners
+# can be identified even when only part of the board is visible. That is
+# what makes the fisheye edges usable, where a full checkerboard rarely fits.
+# The layout follows cv2.aruco.CharucoBoard (non-legacy pattern): the top left
+# square is black, the markers sit in the squares where x + y is odd and
+# their ids increase row by row. The result is checked against OpenCV's own
+# rendering and by detecting it with the same setup corners.py uses.
+
+MM_PER_INCH = 25.4
+
+
+def render_checkerboard(squares_x, squares_y, square_px, first_black=True):
+    """Checkerboard of squares_x by squares_y squares, square_px pixels each."""
+    rows = np.arange(squares_y * square_px) // square_px
+    cols = np.arange(squares_x * square_px) // square_px
+    black = (rows[:, None] + cols[None, :]) % 2 == (0 if first_black else 1)
+    return np.where(black, 0, 255).astype(np.uint8)
+
+
+def marker_bits(dictionary, ids):
+    """(len(ids), n, n) bits of the given markers, as OpenCV decodes them."""
+    n = dictionary.markerSize
+    return np.stack([cv2.aruco.Dictionary.getBitsFromByteList(dictionary.bytesList[i:i + 1], n)
+                     for i in ids])
+
+
+def marker_layout(count, square_px, marker_px):
+    """Marker top left pixel and side along one axis of count squares.
+
+    Follows the float32 arithmetic of cv2.aruco.CharucoBoard.generateImage
+    (OpenCV 4.7+): the markers are drawn as a board of their own, stretched
+    over the area between the outer marker edges. They can land a pixel off
+    the centre of their square and come out a pixel off marker_px.
+    """
+    f = np.float32
+    square = f(square_px)
+    marker = f(marker_px)
+
+    # Pixel range of the marker area
+    zone_marker = marker / square * square
+    zone_margin = f(0.5) * (square - zone_marker)
+    start = int(np.rint(zone_margin))
+    pixels = f(int(np.rint(square * f(count - 1) + zone_margin + zone_marker)) - start)
+
+    # Marker edges in board units, mapped onto that range
+    gap = (square - marker) / f(2)
+    size = (square * f(count - 1) + gap + marker) - gap
+    first = np.arange(count, dtype=f) * square + gap
+    near = (first - gap) / size * pixels
+    far = ((first + marker) - gap) / size * pixels
+    return start + np.rint(near).astype(np.intp), np.rint(far - near).astype(np.intp)
+
+
+def scaled_markers(bits, side):
+    """Markers with a one cell black border, nearest neighbour scaled to side pixels."""
+    cells = bits.shape[1] + 2
+    markers = np.zeros((len(bits), cells, cells), dtype=np.uint8)
+    markers[:, 1:-1, 1:-1] = bits * 255
+    # Same source cell as cv2.resize(..., interpolation=cv2.INTER_NEAREST)
+    scale = np.minimum(np.floor(np.arange(side) * (1.0 / (side / cells))).astype(np.intp), cells - 1)
+    return markers[:, scale[:, None], scale[None, :]]
+
+
+def render_charuco(squares_x, squares_y, square_px, marker_px, dictionary):
+    board = render_checkerboard(squares_x, squares_y, square_px)
+
+    # Markers go into the white squares, numbered row-major
+    rows, cols = np.nonzero((np.add.outer(np.arange(squares_y), np.arange(squares_x)) % 2) == 1)
+    count = len(rows)
+    if count > len(dictionary.bytesList):
+        raise SystemExit(f"ERROR: The board needs {count} markers, the dictionary only has {len(dictionary.bytesList)}")
+    bits = marker_bits(dictionary, np.arange(count))
+
+    origin_x, side_x = marker_layout(squares_x, square_px, marker_px)
+    origin_y, side_y = marker_layout(squares_y, square_px, marker_px)
+    sides = np.minimum(side_x[cols], side_y[rows])
+
+    # Place all markers of one size at once, indexing (marker, y, x) blocks of
+    # the board. Usually there is only a single size.
+    for side in np.unique(sides):
+        ids = np.flatnonzero(sides == side)
+        span = np.arange(side)
+        ys = origin_y[rows[ids], None] + span
+        xs = origin_x[cols[ids], None] + span
+        board[ys[:, :, None], xs[:, None, :]] = scaled_markers(bits[ids], side)
+    return board
+
+
+def verify_charuco(image, squares_x, squares_y, square_px, marker_px, dictionary):
+    """Compare against OpenCV's own rendering, if this OpenCV can do that."""
+    try:
+        # In pixels, so the reference has exactly the rounded sizes we rendered
+        board = cv2.aruco.CharucoBoard((squares_x, squares_y), square_px, marker_px, dictionary)
+        reference = board.generateImage(image.shape[::-1], marginSize=0, borderBits=1)
+    except (AttributeError, cv2.error):
+        print("Note: cv2.aruco.CharucoBoard not available, skipping layout check.")
+        return
+    mismatch = np.count_nonzero(reference != image) / image.size
+    if mismatch > 0.01:
+        raise SystemExit(f"ERROR: Board differs from cv2.aruco.CharucoBoard in {mismatch:.1%} of the pixels.")
+
+
+def check_charuco_detection(image, definition, dictionary):
+    """Detect the board in the final image the same way corners.py does."""
+    try:
+        board = cv2.aruco.CharucoBoard((definition['squares_x'], definition['squares_y']),
+                                       1.0, definition['marker_mm'] / definition['square_mm'],
+                                       dictionary)
+        detector = cv2.aruco.CharucoDetector(board)
+    except (AttributeError, cv2.error):
+        print("Note: cv2.aruco.CharucoDetector not available, skipping detection check.")
+        return
+    corners, ids, _, _ = detector.detectBoard(image)
+    expected = (definition['squares_x'] - 1) * (definition['squares_y'] - 1)
+    found = 0 if ids is None else len(ids)
+    if found != expected:
+        raise SystemExit(f"ERROR: Only {found} of {expected} ChArUco corners detected in the generated board.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a calibration target and its board definition")
+    parser.add_argument('--type', choices=('checkerboard', 'charuco'), default='checkerboard')
+    parser.add_argument('--squares-x', type=int, default=7, help="number of squares along the width")
+    parser.add_argument('--squares-y', type=int, default=10, help="number of squares along the height")
+    parser.add_argument('--square-mm', type=float, default=25.4, help="printed size of one square")
+    parser.add_argument('--marker-mm', type=float, help="printed size of one ArUco marker (charuco)")
+    parser.add_argument('--dictionary', default='DICT_5X5_100', help="ArUco dictionary (charuco)")
+    parser.add_argument('--dpi', type=float, default=100, help="print resolution")
+    parser.add_argument('--margin-mm', type=float, help="white margin around the board (default: half a square)")
+    parser.add_argument('--output', help="image file (default: checkerboard_pattern.png / charuco_board.png)")
+    parser.add_argument('--definition', default='board.json', help="board definition file")
+    parser.add_argument('--no-show', action='store_true', help="do not display the generated board")
+    args = parser.parse_args()
+
+    px_per_mm = args.dpi / MM_PER_INCH
+    square_px = int(round(args.square_mm * px_per_mm))
+    margin_mm = args.square_mm / 2 if args.margin_mm is None else args.margin_mm
+    margin_px = int(round(margin_mm * px_per_mm))
+
+    definition = {
+        'type': args.type,
+        'squares_x': args.squares_x,
+        'squares_y': args.squares_y,
+        'square_mm': args.square_mm,
+        'dpi': args.dpi,
+    }
+
+    if args.type == 'charuco':
+        marker_mm = args.square_mm * 0.75 if args.marker_mm is None else args.marker_mm
+        marker_px = int(round(marker_mm * px_per_mm))
+        if marker_px >= square_px:
+            raise SystemExit("ERROR: Markers must be smaller than the squares.")
+        dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, args.dictionary))
+        board_img = render_charuco(args.squares_x, args.squares_y, square_px, marker_px, dictionary)
+        verify_charuco(board_img, args.squares_x, args.squares_y, square_px, marker_px, dictionary)
+        definition.update(marker_mm=marker_mm, dictionary=args.dictionary, legacy_pattern=False)
+        output = args.output or 'charuco_board.png'
+    else:
+        board_img = render_checkerboard(args.squares_x, args.squares_y, square_px)
+        output = args.output or 'checkerboard_pattern.png'
+
+    image = np.pad(board_img, margin_px, constant_values=255)
+    definition['image'] = output
+    if args.type == 'charuco':
+        check_charuco_detection(image, definition, dictionary)
+
+    # --- Save and Display ---
+    cv2.imwrite(output, image)
+    with open(args.definition, 'w') as f:
+        json.dump(definition, f, indent=2)
+
+    print(f"{args.type.capitalize()} saved as {output}, board definition as {args.definition}")
+    print(f"Pattern details:")
+    print(f"  - Internal corners: ({args.squares_x - 1}, {args.squares_y - 1})")
+    print(f"  - Number of squares: ({args.squares_x}W x {args.squares_y}H)")
+    print(f"  - Square size: {args.square_mm} mm, {square_px}x{square_px} pixels at {args.dpi} dpi")
+    if args.type == 'charuco':
+        print(f"  - Marker size: {definition['marker_mm']} mm, dictionary {args.dictionary}")
+    print(f"  - Image dimensions: {image.shape[1]}x{image.shape[0]} pixels")
+
+    if not args.no_show:
+        cv2.imshow("Generated Board", image)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+
+    print("\n--- Instructions for Use ---")
+    print(f"1. Print '{output}' at {args.dpi} dpi (no scaling) on a flat, rigid surface.")
+    print(f"   Ensure high contrast and sharp edges, or display it on a *flat* monitor.")
+    print(f"2. Measure the *actual physical size* of one square and update square_mm in")
+    print(f"   '{args.definition}' if it differs from {args.square_mm} mm. It sets the metric")
+    print(f"   scale of the calibration, e.g. the stereo baseline.")
+    if args.type == 'charuco':
+        print(f"   Update marker_mm as well, the marker/square ratio is used for detection.")
+    print(f"3. Keep '{args.definition}' next to the calibration scripts, corners.py uses it")
+    print(f"   to detect this board.")
+    if args.type == 'charuco':
+        print(f"4. Capture the board from various angles and distances. It does not need to be")
+        print(f"   fully visible, make sure to cover the edges of the fisheye image as well.")
+    else:
+        print(f"4. Capture the board from various angles and distances, ensuring the entire")
+        print(f"   board is visible and fills a good portion of the frame.")
+    print(f"5. Run distortion.py (single camera) or stereo_calibration.py.")
+
+
+if __name__ == '__main__':
+    main()
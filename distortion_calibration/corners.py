@@ -0,0 +1,69 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+# --- Calibration target detection shared by distortion.py and stereo_calibration.py ---
+#
+# The board is described by the definition file written by checkerboard_gen.py
+# (BOARD_DEFINITION). Without one, the default 6x9 inner corner checkerboard
+# with 25.4 mm squares is assumed. Object points are in metres for both board
+# types, scaled by the measured square_mm, so stereo extrinsics come out metric.
+
+BOARD_DEFINITION = 'board.json'
+
+CHECKERBOARD = (6,9) # Number of internal corners (e.g., (cols-1, rows-1) squares)
+MIN_CHARUCO_CORNERS = 8 # Fewer corners of a partially visible board are not worth using
+
+subpix_criteria = (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER, 30, 0.1)
+subpix_window_size = (11,11) # Using a slightly larger window often helps
+find_corners_flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE # Removed FAST_CHECK for better detection
+
+board_definition = {'type': 'checkerboard', 'squares_x': CHECKERBOARD[0] + 1, 'squares_y': CHECKERBOARD[1] + 1,
+                    'square_mm': 25.4}
+if os.path.exists(BOARD_DEFINITION):
+    with open(BOARD_DEFINITION) as f:
+        board_definition = json.load(f)
+    CHECKERBOARD = (board_definition['squares_x'] - 1, board_definition['squares_y'] - 1)
+SQUARE_SIZE = board_definition['square_mm'] / 1000 # In metres
+
+if board_definition['type'] == 'charuco':
+    _dictionary = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, board_definition['dictionary']))
+    _board = cv2.aruco.CharucoBoard((board_definition['squares_x'], board_definition['squares_y']),
+                                    SQUARE_SIZE, board_definition['marker_mm'] / 1000,
+                                    _dictionary)
+    if board_definition.get('legacy_pattern', False):
+        _board.setLegacyPattern(True)
+    _detector = cv2.aruco.CharucoDetector(_board)
+    _board_corners = np.asarray(_board.getChessboardCorners(), dtype=np.float32)
+
+# Object points of the full checkerboard, in metres
+objp = np.zeros((1, CHECKERBOARD[0]*CHECKERBOARD[1], 3), np.float32)
+objp[0,:,:2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2) * SQUARE_SIZE
+all_ids = np.arange(CHECKERBOARD[0]*CHECKERBOARD[1])
+
+
+def find_charuco_corners(gray):
+    corners, ids, _, _ = _detector.detectBoard(gray)
+    if ids is None or len(ids) < MIN_CHARUCO_CORNERS:
+        return None
+    ids = ids.flatten()
+    return _board_corners[ids].reshape((1, -1, 3)), corners.reshape((-1, 1, 2)).astype(np.float32), ids
+
+
+def find_corners(gray):
+    """Detect the board in a GRAY8 image.
+
+    Returns (object_points, image_points, ids) with shapes (1, N, 3), (N, 1, 2)
+    and (N,), or None if the board was not found. A ChArUco board may be only
+    partially visible, ids tells which corners were found.
+    """
+    if board_definition['type'] == 'charuco':
+        return find_charuco_corners(gray)
+
+    ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD, find_corners_flags)
+    if not ret:
+        return None
+    cv2.cornerSubPix(gray, corners, subpix_window_size, (-1,-1), subpix_criteria)
+    return objp, corners, all_ids
@@ -4,104 +4,110 @@ assert major_version >= 3, 'The fisheye module requires opencv version >= 3.0.0'
 import numpy as np
 import os
 import glob
+from calib_dataset import CalibrationDataset, EYE_LEFT, EYE_RIGHT
+from corners import find_corners
 
 # --- CONFIGURATION ---
-CHECKERBOARD = (6,9) # Number of internal corners (e.g., (cols-1, rows-1) squares)
-IMAGE_PATH_PATTERN = '*.jpg' # Or your specific path and pattern
+# The board (CHECKERBOARD) and corner refinement are configured in corners.py
+DATASET_PATH = 'calibration_dataset' # Written by capture_unscrambled_feed.py, preferred if present
+DATASET_EYE = None # Only calibrate this eye from the dataset (0: left, 1: right, None: each eye separately)
+IMAGE_PATH_PATTERN = '*.jpg' # Fallback: your specific path and pattern, all images of one eye
+# Images must be in the "xrealultra2dec rotation=2" orientation (480x640 per eye),
+# the K/D saved below are only valid for frames oriented that way.
+# Dataset frames give K_left/D_left and K_right/D_right, the image fallback K/D.
+CALIBRATION_OUTPUT = 'camera_calibration.npz' # For parts/passthrough.py and stereo_calibration.py
+EYE_NAMES = {EYE_LEFT: 'left', EYE_RIGHT: 'right'}
 
 # --- CALIBRATION PARAMETERS ---
-subpix_criteria = (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER, 30, 0.1)
-subpix_window_size = (11,11) # Using a slightly larger window often helps
 calibration_flags = cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC+cv2.fisheye.CALIB_CHECK_COND+cv2.fisheye.CALIB_FIX_SKEW
 
-# --- PREPARE OBJECT POINTS ---
-objp = np.zeros((1, CHECKERBOARD[0]*CHECKERBOARD[1], 3), np.float32)
-objp[0,:,:2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2)
 
-_img_shape = None
-objpoints = [] # 3d point in real world space
-imgpoints = [] # 2d points in image plane.
+def calibrate(name, images, load_gray):
+    """Detect the board in images and solve the fisheye intrinsics.
 
-images = glob.glob(IMAGE_PATH_PATTERN)
-print(f"Found {len(images)} images matching pattern: {IMAGE_PATH_PATTERN}")
-if not images:
-    print(f"Error: No images found. Check your IMAGE_PATH_PATTERN: '{IMAGE_PATH_PATTERN}'")
-    exit()
-
-for fname in images:
-    img = cv2.imread(fname)
-    if img is None:
-        print(f"Failed to load image: {fname}. Skipping.")
-        continue
+    Returns (K, D, (width, height)) or None if the calibration failed.
+    """
+    _img_shape = None
+    objpoints = [] # 3d point in real world space
+    imgpoints = [] # 2d points in image plane.
 
-    if _img_shape is None:
-        _img_shape = img.shape[:2] # (height, width)
-    else:
-        if _img_shape != img.shape[:2]:
-            print(f"Image {fname} has different size {img.shape[:2]} than expected {_img_shape}. Skipping.")
+    for fname, source in images:
+        gray = load_gray(source)
+        if gray is None:
+            print(f"Failed to load image: {fname}. Skipping.")
             continue
 
-    gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
-    find_corners_flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE # Removed FAST_CHECK for better detection
-    ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD, find_corners_flags)
-    print(f"Processing {fname}: Found corners = {ret}")
-
-    if ret == True:
-        objpoints.append(objp)
-        cv2.cornerSubPix(gray, corners, subpix_window_size, (-1,-1), subpix_criteria)
-        imgpoints.append(corners)
-        # --- Optional: Draw and display the corners ---
-        # drawn_img = cv2.drawChessboardCorners(img.copy(), CHECKERBOARD, corners, ret)
-        # cv2.imshow('Corners Found', drawn_img)
-        # cv2.waitKey(50)
+        if _img_shape is None:
+            _img_shape = gray.shape[:2] # (height, width)
+        else:
+            if _img_shape != gray.shape[:2]:
+                print(f"Image {fname} has different size {gray.shape[:2]} than expected {_img_shape}. Skipping.")
+                continue
 
-# if len(images) > 0 and any(cv2.getWindowProperty(winname, 0) >= 0 for winname in ['Corners Found']): # Check if window exists
-#     cv2.destroyAllWindows()
+        found = find_corners(gray)
+        print(f"Processing {fname}: Found corners = {found is not None}")
 
+        if found is not None:
+            objp, corners, _ = found
+            objpoints.append(objp)
+            imgpoints.append(corners)
+            # --- Optional: Draw and display the corners ---
+            # drawn_img = cv2.drawChessboardCorners(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), CHECKERBOARD, corners, True)
+            # cv2.imshow('Corners Found', drawn_img)
+            # cv2.waitKey(50)
 
-N_OK = len(objpoints)
-print(f"\nFound {N_OK} valid images for calibration out of {len(images)} processed.")
+    # if len(images) > 0 and any(cv2.getWindowProperty(winname, 0) >= 0 for winname in ['Corners Found']): # Check if window exists
+    #     cv2.destroyAllWindows()
 
-if N_OK == 0:
-    print("Calibration failed: No valid images with detected checkerboards.")
-    exit()
+    N_OK = len(objpoints)
+    print(f"\nFound {N_OK} valid images for the {name} calibration out of {len(images)} processed.")
 
-if _img_shape is None:
-    print("Error: No images were successfully processed to determine image shape.")
-    exit()
+    if N_OK == 0:
+        print("Calibration failed: No valid images with detected checkerboards.")
+        return None
 
-K = np.zeros((3, 3))
-D = np.zeros((4, 1)) # For fisheye, D is (k1, k2, k3, k4)
-rvecs = [np.zeros((1, 1, 3), dtype=np.float64) for _ in range(N_OK)]
-tvecs = [np.zeros((1, 1, 3), dtype=np.float64) for _ in range(N_OK)]
-
-print(f"\nAttempting calibration with {N_OK} image(s)...")
-# Use the shape of the last successfully processed gray image for calibration dimensions
-# This assumes all images are the same size, which is checked earlier.
-calibration_image_shape_wh = gray.shape[::-1] # (width, height)
-print(f"Image shape for calibration: {calibration_image_shape_wh} (width, height)")
-
-try:
-    rms, _, _, _, _ = \
-        cv2.fisheye.calibrate(
-            objpoints,
-            imgpoints,
-            calibration_image_shape_wh, # (width, height) of images
-            K,
-            D,
-            rvecs,
-            tvecs,
-            calibration_flags,
-            (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER, 30, 1e-6)
-        )
-
-    print("\nCalibration successful!")
+    if _img_shape is None:
+        print("Error: No images were successfully processed to determine image shape.")
+        return None
+
+    K = np.zeros((3, 3))
+    D = np.zeros((4, 1)) # For fisheye, D is (k1, k2, k3, k4)
+    rvecs = [np.zeros((1, 1, 3), dtype=np.float64) for _ in range(N_OK)]
+    tvecs = [np.zeros((1, 1, 3), dtype=np.float64) for _ in range(N_OK)]
+
+    print(f"\nAttempting {name} calibration with {N_OK} image(s)...")
+    # All images have the same size, which is checked above
+    calibration_image_shape_wh = _img_shape[::-1] # (width, height)
+    print(f"Image shape for calibration: {calibration_image_shape_wh} (width, height)")
+
+    try:
+        rms, _, _, _, _ = \
+            cv2.fisheye.calibrate(
+                objpoints,
+                imgpoints,
+                calibration_image_shape_wh, # (width, height) of images
+                K,
+                D,
+                rvecs,
+                tvecs,
+                calibration_flags,
+                (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER, 30, 1e-6)
+            )
+    except cv2.error as e:
+        print(f"\nOpenCV Error during calibration: {e}")
+        print("This might happen if input data is still problematic (e.g., insufficient views, poor corner detection).")
+        return None
+
+    print(f"\nCalibration of the {name} camera successful!")
     print(f"RMS re-projection error: {rms}")
     print("Image Dimensions (height, width) = " + str(_img_shape))
     print("K (Intrinsic Matrix) = np.array(" + str(K.tolist()) + ")")
     print("D (Distortion Coefficients) = np.array(" + str(D.tolist()) + ")")
+    print_vslam_parameters(K, D, calibration_image_shape_wh)
+    return K, D, calibration_image_shape_wh
+
 
-    # --- Extract and Print VSLAM Specific Parameters ---
+def print_vslam_parameters(K, D, calibration_image_shape_wh):
     fx = K[0, 0]
     fy = K[1, 1]
     cx = K[0, 2]
@@ -138,10 +144,38 @@ try:
     print(f"Camera.height: {calibration_image_shape_wh[1]}")
     print(f"Camera.fps: 30.0 # Adjust as needed")
     print("Camera.RGB: 1 # Set to 0 if images are grayscale, 1 if color (BGR)")
-    # --- End VSLAM Specific Parameters ---
 
-except cv2.error as e:
-    print(f"\nOpenCV Error during calibration: {e}")
-    print("This might happen if input data is still problematic (e.g., insufficient views, poor corner detection).")
-except Exception as e:
-    print(f"\nAn unexpected error occurred: {e}")
\ No newline at end of file
+
+if os.path.isdir(DATASET_PATH):
+    # GRAY8 frames straight from the memory map, no decoding or color conversion.
+    # The eyes have different lenses and orientations, so each gets its own K/D.
+    dataset = CalibrationDataset.open(DATASET_PATH)
+    eyes = (EYE_LEFT, EYE_RIGHT) if DATASET_EYE is None else (DATASET_EYE,)
+    groups = [(EYE_NAMES[eye], [(f"{DATASET_PATH}[{idx}]", idx) for idx in dataset.select(eye)])
+              for eye in eyes]
+    for name, images in groups:
+        print(f"Found {len(images)} {name} eye frames in dataset: {DATASET_PATH}")
+
+    def load_gray(idx):
+        return dataset[idx]
+else:
+    groups = [(None, [(fname, fname) for fname in glob.glob(IMAGE_PATH_PATTERN)])]
+    print(f"Found {len(groups[0][1])} images matching pattern: {IMAGE_PATH_PATTERN}")
+
+    def load_gray(fname):
+        return cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+
+if not all(images for _, images in groups):
+    print(f"Error: No images found. Check your DATASET_PATH '{DATASET_PATH}' or IMAGE_PATH_PATTERN: '{IMAGE_PATH_PATTERN}'")
+    exit()
+
+calibration = {}
+for name, images in groups:
+    result = calibrate(name or 'camera', images, load_gray)
+    if result is None:
+        exit()
+    suffix = f"_{name}" if name else ""
+    calibration[f"K{suffix}"], calibration[f"D{suffix}"], image_size = result
+
+np.savez(CALIBRATION_OUTPUT, image_size=np.array(image_size), **calibration)
+print(f"\nSaved {', '.join(calibration)} to {CALIBRATION_OUTPUT}")
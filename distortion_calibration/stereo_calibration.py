@@ -0,0 +1,222 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from calib_dataset import CalibrationDataset, EYE_BOTH
+from corners import board_definition, find_corners
+
+# --- Stereo calibration from xrealultra2dec side-by-side frames ---
+#
+# One capture session gives both the per-eye intrinsics and the stereo
+# extrinsics (R, T) that SLAM needs:
+#
+#   python3 stereo_calibration.py --capture --device /dev/video2
+#   python3 stereo_calibration.py                      # re-solve from the dataset
+#   python3 stereo_calibration.py --left-intrinsics camera_calibration.npz --right-intrinsics camera_calibration.npz
+#
+# Frames come straight from "xrealultra2dec rotation=2" (two 480x640 eyes side
+# by side) and are stored in a calibration dataset (calib_dataset.py). The
+# board is detected in both halves concurrently (OpenCV releases the GIL) and
+# only pairs where both detections succeed take part in the stereo solve. For
+# a partially visible ChArUco board only the corners seen by both eyes count.
+# Intrinsics are either loaded (.npz with the eye's K_left/D_left or
+# K_right/D_right as written by distortion.py, or a plain K/D) or
+# calibrated per eye from the same session, and are kept fixed while solving
+# for the extrinsics. Loaded intrinsics must have been calibrated on frames in
+# the rotation=2 orientation (as capture_unscrambled_feed.py stores them),
+# otherwise the fixed principal point is mirrored. T is in metres, corners.py
+# scales the object points by square_mm from the board definition.
+
+EYE_WIDTH = 480
+EYE_HEIGHT = 640
+MIN_COMMON_CORNERS = 8 # Corners both eyes need to share for a pair to be used
+
+calibration_flags = cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC+cv2.fisheye.CALIB_CHECK_COND+cv2.fisheye.CALIB_FIX_SKEW
+calibration_criteria = (cv2.TERM_CRITERIA_EPS+cv2.TERM_CRITERIA_MAX_ITER, 30, 1e-6)
+
+
+def capture(args, dataset):
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+
+    Gst.init(None)
+    pipeline = Gst.parse_launch(
+        f"v4l2src device={args.device} ! xrealultra2dec rotation=2 pts-from-frame=true ! "
+        f"appsink name=sink max-buffers=1 drop=true sync=false")
+    sink = pipeline.get_by_name('sink')
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        print("ERROR: Capture pipeline failed to go to PLAYING state.")
+        sys.exit(1)
+
+    print(f"Capturing {args.count} pairs, one every {args.interval} seconds. Move the board between shots.")
+    try:
+        captured = 0
+        last_capture = time.time()
+        while captured < args.count:
+            sample = sink.emit('try-pull-sample', Gst.SECOND)
+            if sample is None:
+                continue
+            if time.time() - last_capture < args.interval:
+                continue
+
+            buf = sample.get_buffer()
+            success, map_info = buf.map(Gst.MapFlags.READ)
+            if not success:
+                continue
+            frame = np.ndarray(shape=(EYE_HEIGHT, EYE_WIDTH * 2), dtype=np.uint8, buffer=map_info.data)
+            # pts-from-frame makes the PTS the device time (TS1) since the first pair
+            dataset.append(frame, timestamp_ns=buf.pts if buf.pts != Gst.CLOCK_TIME_NONE else 0,
+                           eye=EYE_BOTH, seq=captured)
+            buf.unmap(map_info)
+
+            captured += 1
+            last_capture = time.time()
+            print(f"Captured pair {captured}/{args.count}")
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def detect_pairs(dataset, executor):
+    """Detect the board in both eyes of every frame, two eyes at a time."""
+    left_detections = []
+    right_detections = []
+
+    for idx in range(len(dataset)):
+        frame = dataset[idx]
+        left = executor.submit(find_corners, frame[:, :EYE_WIDTH])
+        right = executor.submit(find_corners, frame[:, EYE_WIDTH:])
+        left_detections.append(left.result())
+        right_detections.append(right.result())
+        print(f"Processing {dataset.path}[{idx}]: left = {left_detections[-1] is not None}, "
+              f"right = {right_detections[-1] is not None}")
+
+    return left_detections, right_detections
+
+
+def calibrate_eye(name, detections):
+    found = [d for d in detections if d is not None]
+    if not found:
+        print(f"Calibration failed: No detections for the {name} eye.")
+        sys.exit(1)
+
+    K = np.zeros((3, 3))
+    D = np.zeros((4, 1))
+    rms, K, D, _, _ = cv2.fisheye.calibrate(
+        [objp for objp, _, _ in found],
+        [corners for _, corners, _ in found],
+        (EYE_WIDTH, EYE_HEIGHT),
+        K,
+        D,
+        None,
+        None,
+        calibration_flags,
+        calibration_criteria)
+    print(f"{name} eye: RMS re-projection error {rms} from {len(found)} images")
+    return K, D
+
+
+def load_intrinsics(path, name):
+    # Per eye K_left/D_left etc. as written by distortion.py, or a plain K/D
+    calib = np.load(path)
+    if f'K_{name}' in calib:
+        return calib[f'K_{name}'], calib[f'D_{name}']
+    return calib['K'], calib['D']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fisheye stereo calibration from xrealultra2dec frames")
+    parser.add_argument('--dataset', default='calibration_stereo', help="dataset of side-by-side frames")
+    parser.add_argument('--capture', action='store_true', help="capture new pairs into the dataset first")
+    parser.add_argument('--device', default='/dev/video0', help="camera device for --capture")
+    parser.add_argument('--count', type=int, default=30, help="number of pairs to capture")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between captured pairs")
+    parser.add_argument('--left-intrinsics', help="K/D of the left eye (.npz) from rotation=2 frames, calibrated if not given")
+    parser.add_argument('--right-intrinsics', help="K/D of the right eye (.npz) from rotation=2 frames, calibrated if not given")
+    parser.add_argument('--output', default='stereo_calibration.npz', help="where to save the result")
+    args = parser.parse_args()
+
+    if args.capture:
+        dataset = CalibrationDataset.create(args.dataset, EYE_WIDTH * 2, EYE_HEIGHT)
+        capture(args, dataset)
+    elif os.path.isdir(args.dataset):
+        dataset = CalibrationDataset.open(args.dataset)
+    else:
+        print(f"Error: Dataset {args.dataset} does not exist. Run with --capture first.")
+        sys.exit(1)
+
+    if (dataset.width, dataset.height) != (EYE_WIDTH * 2, EYE_HEIGHT):
+        print(f"Error: Dataset {args.dataset} holds {dataset.width}x{dataset.height} frames, "
+              f"not {EYE_WIDTH * 2}x{EYE_HEIGHT} side by side pairs.")
+        sys.exit(1)
+    if len(dataset) == 0:
+        print(f"Error: Dataset {args.dataset} is empty. Run with --capture first.")
+        sys.exit(1)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        left_detections, right_detections = detect_pairs(dataset, executor)
+
+    if args.left_intrinsics and args.right_intrinsics:
+        K_left, D_left = load_intrinsics(args.left_intrinsics, 'left')
+        K_right, D_right = load_intrinsics(args.right_intrinsics, 'right')
+    else:
+        # Every detection counts for the intrinsics, not only the paired ones
+        K_left, D_left = calibrate_eye('left', left_detections)
+        K_right, D_right = calibrate_eye('right', right_detections)
+
+    # The fisheye stereo solver insists on (N, 1, 3) / (N, 1, 2) float64 arrays
+    objpoints = []
+    left_points = []
+    right_points = []
+    for left, right in zip(left_detections, right_detections):
+        if left is None or right is None:
+            continue
+        _, left_idx, right_idx = np.intersect1d(left[2], right[2], return_indices=True)
+        if len(left_idx) < MIN_COMMON_CORNERS:
+            continue
+        objpoints.append(left[0][0, left_idx].reshape(-1, 1, 3).astype(np.float64))
+        left_points.append(left[1][left_idx].reshape(-1, 1, 2).astype(np.float64))
+        right_points.append(right[1][right_idx].reshape(-1, 1, 2).astype(np.float64))
+
+    print(f"\nFound {len(objpoints)} pairs with the board in both eyes out of {len(dataset)} frames.")
+    if not objpoints:
+        print("Stereo calibration failed: No pair with detections in both eyes.")
+        sys.exit(1)
+
+    result = cv2.fisheye.stereoCalibrate(
+        objpoints, left_points, right_points,
+        K_left, D_left, K_right, D_right,
+        (EYE_WIDTH, EYE_HEIGHT),
+        flags=cv2.fisheye.CALIB_FIX_INTRINSIC,
+        criteria=calibration_criteria)
+    rms, R, T = result[0], result[5], result[6]
+
+    print("\nStereo calibration successful!")
+    print(f"RMS re-projection error: {rms}")
+    print("R = np.array(" + str(R.tolist()) + ")")
+    print("T = np.array(" + str(T.tolist()) + ")")
+    print(f"Baseline: {np.linalg.norm(T) * 1000:.2f} mm (square_mm {board_definition['square_mm']} from corners.py)")
+
+    np.savez(args.output, K_left=K_left, D_left=D_left, K_right=K_right, D_right=D_right,
+             R=R, T=T, image_size=np.array((EYE_WIDTH, EYE_HEIGHT)))
+    print(f"Saved intrinsics and extrinsics to {args.output}")
+
+    # ORB_SLAM3 wants the pose of camera 2 in camera 1, the inverse of (R, T)
+    T_c1_c2 = np.eye(4)
+    T_c1_c2[:3, :3] = R.T
+    T_c1_c2[:3, 3] = (-R.T @ T).flatten()
+    print("\n# ORB_SLAM3 stereo fisheye extrinsics:")
+    print("Stereo.T_c1_c2: !!opencv-matrix")
+    print("  rows: 4")
+    print("  cols: 4")
+    print("  dt: f")
+    print("  data: [" + ", ".join(f"{v:.6f}" for v in T_c1_c2.flatten()) + "]")
+
+
+if __name__ == '__main__':
+    main()
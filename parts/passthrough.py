@@ -0,0 +1,234 @@
+# Usage
+#
+#   gst-launch-1.0 v4l2src device=/dev/videoX ! xrealultra2dec rotation=2 ! \
+#       xrealpassthrough calibration=camera_calibration.npz display-fov=90 ! autovideosink
+#
+# Camera to display passthrough. Every display pixel of an eye is traced back
+# through the display lens (radial pre-warp display-k1/display-k2 over a
+# pinhole of display-fov) into a viewing ray, and that ray is projected into
+# the fisheye camera image using the calibrated fisheye K/D. Both steps
+# are composed into a single fixed point remap table per eye, so each eye is
+# resampled exactly once per frame instead of undistorting and then warping.
+#
+# The tables are only rebuilt when one of the parameters changes.
+#
+# The calibration file is the .npz saved by distortion.py or
+# stereo_calibration.py. It either holds "K"/"D" (used for both eyes) or per
+# eye "K_left"/"D_left" and "K_right"/"D_right". The intrinsics need to be
+# calibrated in the same orientation as the decoder output (rotation=2,
+# 480x640 per eye), which is how capture_unscrambled_feed.py stores frames.
+#
+# Installation
+#
+# Same as xreal.py, this is a python gstreamer plugin and needs to be placed
+# (or symlinked) in the "python" subdirectory of the GST_PLUGIN_PATH.
+
+import gi
+import numpy as np
+import cv2
+
+gi.require_version('Gst', '1.0')
+gi.require_version('GstBase', '1.0')
+from gi.repository import Gst, GLib, GObject, GstBase
+
+CAM_WIDTH = 480
+CAM_HEIGHT = 640
+
+ICAPS = Gst.Caps(Gst.Structure('video/x-raw',
+                               format='GRAY8',
+                               width=CAM_WIDTH*2,
+                               height=CAM_HEIGHT,
+                               framerate=Gst.FractionRange(Gst.Fraction(1, 1),
+                                                           Gst.Fraction(GLib.MAXINT, 1))))
+
+OCAPS = Gst.Caps(Gst.Structure('video/x-raw',
+                               format='GRAY8',
+                               framerate=Gst.FractionRange(Gst.Fraction(1, 1),
+                                                           Gst.Fraction(GLib.MAXINT, 1))))
+
+
+def build_passthrough_map(K, D, display_size, fov, k1, k2):
+    """Compose display warp and fisheye undistortion into one remap table.
+
+    Returns the fixed point (CV_16SC2, CV_16UC1) map pair for cv2.remap that
+    maps every display pixel of one eye to its camera image position.
+    """
+    width, height = display_size
+    focal = (width / 2) / np.tan(np.radians(fov) / 2)
+
+    u, v = np.meshgrid(np.arange(width, dtype=np.float64),
+                       np.arange(height, dtype=np.float64))
+    x = (u - (width - 1) / 2) / focal
+    y = (v - (height - 1) / 2) / focal
+
+    # Undo the display lens distortion to get the ideal viewing direction
+    r2 = x * x + y * y
+    scale = 1 + k1 * r2 + k2 * r2 * r2
+    rays = np.stack((x * scale, y * scale, np.ones_like(x)), axis=-1).reshape((-1, 1, 3))
+
+    # And project it into the distorted fisheye image
+    img_pts, _ = cv2.fisheye.projectPoints(rays, np.zeros((3, 1)), np.zeros((3, 1)), K, D)
+    map_xy = img_pts.reshape((height, width, 2)).astype(np.float32)
+
+    return cv2.convertMaps(map_xy, None, cv2.CV_16SC2)
+
+
+class XRealPassthrough(GstBase.BaseTransform):
+    __gstmetadata__ = ('XRealPassthrough','Filter/Effect/Video', \
+                       'Undistort and warp XReal camera frames for the display in one pass', 'Ani')
+
+    __gsttemplates__ = (Gst.PadTemplate.new("src",
+                                            Gst.PadDirection.SRC,
+                                            Gst.PadPresence.ALWAYS,
+                                            OCAPS),
+                        Gst.PadTemplate.new("sink",
+                                            Gst.PadDirection.SINK,
+                                            Gst.PadPresence.ALWAYS,
+                                            ICAPS))
+
+    __gproperties__ = {
+        "calibration": (str,
+                   "Calibration file",
+                   "Camera K/D as saved by distortion.py (.npz)",
+                   None,
+                   GObject.ParamFlags.READWRITE
+                  ),
+        "display-width": (int,
+                   "Display width",
+                   "Width of one eye on the display",
+                   1,
+                   GLib.MAXINT,
+                   960,
+                   GObject.ParamFlags.CONSTRUCT_ONLY | GObject.ParamFlags.READWRITE
+                  ),
+        "display-height": (int,
+                   "Display height",
+                   "Height of one eye on the display",
+                   1,
+                   GLib.MAXINT,
+                   1080,
+                   GObject.ParamFlags.CONSTRUCT_ONLY | GObject.ParamFlags.READWRITE
+                  ),
+        "display-fov": (float,
+                   "Display field of view",
+                   "Horizontal field of view of one eye in degrees",
+                   1.0,
+                   179.0,
+                   90.0,
+                   GObject.ParamFlags.READWRITE
+                  ),
+        "display-k1": (float,
+                   "Display k1",
+                   "First radial distortion coefficient of the display lens",
+                   -GLib.MAXDOUBLE,
+                   GLib.MAXDOUBLE,
+                   0.0,
+                   GObject.ParamFlags.READWRITE
+                  ),
+        "display-k2": (float,
+                   "Display k2",
+                   "Second radial distortion coefficient of the display lens",
+                   -GLib.MAXDOUBLE,
+                   GLib.MAXDOUBLE,
+                   0.0,
+                   GObject.ParamFlags.READWRITE
+                  )
+    }
+
+    PROPS = {
+        'calibration': '_calibration',
+        'display-width': '_display_width',
+        'display-height': '_display_height',
+        'display-fov': '_fov',
+        'display-k1': '_k1',
+        'display-k2': '_k2',
+    }
+
+    def __init__(self):
+        GstBase.BaseTransform.__init__(self)
+
+        self._calibration = None
+        self._display_width = 960
+        self._display_height = 1080
+        self._fov = 90.0
+        self._k1 = 0.0
+        self._k2 = 0.0
+
+        # One (map1, map2) pair per eye, None until (re)built
+        self._maps = None
+
+    def do_get_property(self, prop):
+        if prop.name in self.PROPS:
+            return getattr(self, self.PROPS[prop.name])
+        else:
+            raise AttributeError('unknown property %s' % prop.name)
+
+    def do_set_property(self, prop, value):
+        if prop.name in self.PROPS:
+            if getattr(self, self.PROPS[prop.name]) != value:
+                setattr(self, self.PROPS[prop.name], value)
+                self._maps = None
+        else:
+            raise AttributeError('unknown property %s' % prop.name)
+
+    def do_transform_caps(self, direction, caps, filt):
+        if direction == Gst.PadDirection.SINK:
+            return Gst.Caps(Gst.Structure('video/x-raw',
+                                          format='GRAY8',
+                                          width=self._display_width*2,
+                                          height=self._display_height,
+                                          framerate=Gst.FractionRange(Gst.Fraction(1, 1),
+                                                                      Gst.Fraction(GLib.MAXINT, 1))))
+        else:
+            return ICAPS
+
+    def load_intrinsics(self):
+        if self._calibration is None:
+            # Without a calibration assume an ideal (undistorted) camera
+            f = CAM_WIDTH / 2
+            K = np.array([[f, 0, (CAM_WIDTH - 1) / 2], [0, f, (CAM_HEIGHT - 1) / 2], [0, 0, 1]])
+            D = np.zeros((4, 1))
+            return (K, D), (K, D)
+
+        calib = np.load(self._calibration)
+        if 'K_left' in calib:
+            return (calib['K_left'], calib['D_left']), (calib['K_right'], calib['D_right'])
+        return (calib['K'], calib['D']), (calib['K'], calib['D'])
+
+    def build_maps(self):
+        display_size = (self._display_width, self._display_height)
+        return [build_passthrough_map(K, D, display_size, self._fov, self._k1, self._k2)
+                for K, D in self.load_intrinsics()]
+
+    def do_transform(self, inbuf, outbuf):
+        maps = self._maps
+        if maps is None:
+            maps = self._maps = self.build_maps()
+
+        success, in_map_info = inbuf.map(Gst.MapFlags.READ)
+        assert success
+        np_in = np.ndarray(
+            shape=(CAM_HEIGHT, CAM_WIDTH * 2),
+            dtype=np.uint8,
+            buffer=in_map_info.data)
+
+        success, out_map_info = outbuf.map(Gst.MapFlags.WRITE)
+        assert success
+        np_out = np.ndarray(
+            shape=(self._display_height, self._display_width * 2),
+            dtype=np.uint8,
+            buffer=out_map_info.data)
+
+        for eye, (map1, map2) in enumerate(maps):
+            src = np_in[:, eye * CAM_WIDTH:(eye + 1) * CAM_WIDTH]
+            dst = np_out[:, eye * self._display_width:(eye + 1) * self._display_width]
+            cv2.remap(src, map1, map2, cv2.INTER_LINEAR, dst=dst,
+                      borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+        inbuf.unmap(in_map_info)
+        outbuf.unmap(out_map_info)
+
+        return Gst.FlowReturn.OK
+
+GObject.type_register(XRealPassthrough)
+__gstelementfactory__ = ("xrealpassthrough", Gst.Rank.NONE, XRealPassthrough)
@@ -0,0 +1,125 @@
+# Opt-in span tracing, dumped as Chrome trace-event JSON.
+#
+# Enable it by pointing XREAL_TRACE at the output file (or with the
+# "trace-file" property of xrealultra2dec):
+#
+#   XREAL_TRACE=/tmp/decode.json gst-launch-1.0 v4l2src ! xrealultra2dec ! ...
+#
+# and open the result in chrome://tracing or https://ui.perfetto.dev.
+#
+# Spans are stored in preallocated arrays, nothing is allocated or formatted
+# while recording. When tracing is disabled the code uses NULL_TRACE, whose
+# methods do nothing, so the hooks can stay in place.
+#
+#   t = trace.begin()
+#   ...
+#   trace.end('descramble', t)
+
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+TRACE_ENV = 'XREAL_TRACE'
+DEFAULT_CAPACITY = 1 << 18
+
+
+class NullTrace:
+    def __bool__(self):
+        return False
+
+    def begin(self):
+        return 0
+
+    def end(self, name, start_ns):
+        pass
+
+    def dump(self):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class TraceBuffer:
+    def __init__(self, path, process_name='xreal', capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.process_name = process_name
+        self.capacity = capacity
+
+        self._names = {}
+        self._name_ids = np.zeros(capacity, dtype=np.uint16)
+        self._start = np.zeros(capacity, dtype=np.int64)
+        # -1 marks slots that have not been written yet
+        self._duration = np.full(capacity, -1, dtype=np.int64)
+        self._thread = np.zeros(capacity, dtype=np.uint64)
+        # next() on a count is atomic under the GIL, so streaming threads can
+        # record concurrently without a lock.
+        self._slots = itertools.count()
+        self._origin = time.perf_counter_ns()
+
+        atexit.register(self.dump)
+
+    def __bool__(self):
+        return True
+
+    def begin(self):
+        return time.perf_counter_ns()
+
+    def end(self, name, start_ns):
+        end_ns = time.perf_counter_ns()
+        slot = next(self._slots)
+        if slot >= self.capacity:
+            return
+
+        name_id = self._names.get(name)
+        if name_id is None:
+            name_id = self._names.setdefault(name, len(self._names))
+
+        self._name_ids[slot] = name_id
+        self._start[slot] = start_ns
+        self._duration[slot] = end_ns - start_ns
+        self._thread[slot] = threading.get_ident()
+
+    def dump(self):
+        atexit.unregister(self.dump)
+
+        recorded = np.flatnonzero(self._duration >= 0)
+        # Slots past the capacity were counted but not stored
+        dropped = max(next(self._slots) - self.capacity, 0)
+        names = {v: k for k, v in self._names.items()}
+        pid = os.getpid()
+
+        events = [{
+            'name': 'process_name',
+            'ph': 'M',
+            'pid': pid,
+            'args': {'name': self.process_name},
+        }]
+        for i in recorded:
+            events.append({
+                'name': names[int(self._name_ids[i])],
+                'ph': 'X',
+                'pid': pid,
+                'tid': int(self._thread[i]),
+                'ts': (int(self._start[i]) - self._origin) / 1000,
+                'dur': int(self._duration[i]) / 1000,
+            })
+
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print(f"Wrote {len(recorded)} trace events to {self.path}")
+        if dropped:
+            print(f"WARNING: {dropped} trace events dropped, the buffer holds only {self.capacity}")
+
+
+def trace_from_env(process_name='xreal', path=None):
+    """TraceBuffer writing to path (or $XREAL_TRACE), NULL_TRACE if neither is set."""
+    path = path or os.environ.get(TRACE_ENV)
+    if not path:
+        return NULL_TRACE
+    return TraceBuffer(path, process_name)
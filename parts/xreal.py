@@ -6,6 +6,31 @@
 #  - 0: native (left CW, right CCW)
 #  - 1: flip right (both CW)
 #  - 2: correct for viewing stream
+#  - 3: native layout, orientation described in the caps
+#
+# rotation=3 keeps both eyes in native order (640x960, left on top). The caps
+# fields "left-orientation"/"right-orientation" hold the videoflip nick that
+# turns each eye into the rotation=2 view, for a GPU or remap to absorb:
+#
+#   ... ! xrealultra2dec rotation=3 ! videocrop top=480 ! videoflip video-direction=ul-lr ! ...
+#
+# max-latency (in ns) drops frames whose device timestamp (TS2) is older than
+# the budget before descrambling them, so a backlog drains cheaply and only
+# the freshest pair is decoded. The "dropped" property counts them:
+#
+#   gst-launch-1.0 v4l2src device=/dev/videoX ! xrealultra2dec max-latency=20000000 ! ...
+#
+# XREAL_TRACE=/path/trace.json (or trace-file) records Chrome trace spans of
+# the decode stages, written when the element stops (see trace_events.py).
+# "downstream+wait" runs until the next input buffer, so on a live source it
+# mostly is the wait for the camera, not downstream backpressure.
+#
+# "gamma" and "normalize" (fixed mean/contrast from running statistics) build
+# a per-eye lookup table that is applied inside the descramble pass. From
+# Python element.set_lut(eye, table) adds a custom curve on top of them, None
+# removes it again:
+#
+#   gst-launch-1.0 v4l2src device=/dev/videoX ! xrealultra2dec normalize=true gamma=1.5 ! ...
 #
 # Installation
 #
@@ -18,7 +43,8 @@
 #  - mkdir -p ~/.gstreamer-1.0/plugins/python/
 #  - cp xreal.py ~/.gstreamer-1.0/plugins/python/
 #
-# Or symlink the file.
+# Or symlink the file. trace_events.py is looked up next to the (resolved)
+# xreal.py, so when copying instead of symlinking copy it along.
 #
 # Note that this should be ~/.local/share/gstreamer-1.0/plugins/python, however
 # at least on Fedora the path appears to be misconfigured or missing the XDG
@@ -28,7 +54,11 @@
 
 import gi
 import numpy as np
+import os
 import struct
+import sys
+import threading
+import time
 
 gi.require_version('Gst', '1.0')
 gi.require_version('GstBase', '1.0')
@@ -36,6 +66,9 @@ gi.require_version('GstAudio', '1.0')
 gi.require_version('GstVideo', '1.0')
 from gi.repository import Gst, GLib, GObject, GstBase, GstAudio, GstVideo
 
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from trace_events import NULL_TRACE, trace_from_env
+
 # TODO: Put in the caps that v4l2src will provide for the device
 ICAPS = Gst.Caps(Gst.Structure('video/x-raw',
                                framerate=Gst.FractionRange(Gst.Fraction(1, 1),
@@ -56,6 +89,21 @@ OCAPS_HORIZ = \
                            framerate=Gst.FractionRange(Gst.Fraction(1, 1),
                                                        Gst.Fraction(GLib.MAXINT, 1))))
 
+# Orientation needed to turn each native eye into the rotation=2 view. The
+# right eye is transposed, the left eye is flipped along the other diagonal.
+LEFT_ORIENTATION = 'ur-ll'
+RIGHT_ORIENTATION = 'ul-lr'
+
+OCAPS_META = \
+    Gst.Caps(Gst.Structure('video/x-raw',
+                           format='GRAY8',
+                           width=640,
+                           height=480*2,
+                           framerate=Gst.FractionRange(Gst.Fraction(1, 1),
+                                                       Gst.Fraction(GLib.MAXINT, 1)),
+                           **{'left-orientation': LEFT_ORIENTATION,
+                              'right-orientation': RIGHT_ORIENTATION}))
+
 OCAPS = OCAPS_VERT.copy()
 OCAPS.append(OCAPS_HORIZ)
 
@@ -81,11 +129,47 @@ class XRealUltra2Dec(GstBase.BaseTransform):
                   ),
         "rotation": (int,
                    "Image rotation",
-                   "Rotation: 0: native (CW, CCW), 1: both CW, 2: horizontal",
+                   "Rotation: 0: native (CW, CCW), 1: both CW, 2: horizontal, 3: native with orientation in caps",
                    0,
-                   2,
+                   3,
                    0,
                    GObject.ParamFlags.CONSTRUCT_ONLY | GObject.ParamFlags.READWRITE
+                  ),
+        "max-latency": (GObject.TYPE_UINT64,
+                   "Maximum latency",
+                   "Drop frames older than this (in ns) relative to the estimated host time, 0 to disable",
+                   0,
+                   GLib.MAXUINT64,
+                   0,
+                   GObject.ParamFlags.READWRITE
+                  ),
+        "dropped": (GObject.TYPE_UINT64,
+                   "Dropped frames",
+                   "Number of frames dropped for exceeding max-latency",
+                   0,
+                   GLib.MAXUINT64,
+                   0,
+                   GObject.ParamFlags.READABLE
+                  ),
+        "trace-file": (str,
+                   "Trace file",
+                   "Write a Chrome trace-event JSON of the decode stages here on stop (default: $XREAL_TRACE)",
+                   None,
+                   GObject.ParamFlags.READWRITE
+                  ),
+        "gamma": (float,
+                   "Gamma",
+                   "Gamma applied through the per-eye lookup table, 1.0 to disable",
+                   0.1,
+                   10.0,
+                   1.0,
+                   GObject.ParamFlags.READWRITE
+                  ),
+        "normalize": (bool,
+                   "Normalize exposure",
+                   "Stretch each eye to a fixed mean and contrast from running statistics",
+                   False,
+                   GObject.ParamFlags.READWRITE
                   )
     }
 
@@ -101,12 +185,52 @@ class XRealUltra2Dec(GstBase.BaseTransform):
         38, 58, 10, 23, 33, 55, 57, 107, 100, 94, 27, 95, 45, 91, 4, 114
     ]
     CHUNK_SIZE = 2400
+    CHUNK_ORDER = np.array(CHUNK_MAP, dtype=np.intp)
+
+    # Allowed drift between the device and host clocks per frame. The clock
+    # offset estimate is relaxed by this much so it can follow a slower device
+    # clock instead of sticking to the smallest offset ever seen.
+    CLOCK_DRIFT_NS = 5000
+
+    # Exposure normalization: target brightness/contrast, the weight of a new
+    # frame in the running statistics and the input subsampling for them.
+    NORM_MEAN = 128.0
+    NORM_STD = 48.0
+    NORM_ALPHA = 0.05
+    NORM_STRIDE = 61
+    LUT_BASE = np.arange(256, dtype=np.float32)
+    LUT_BANKS = 3
 
     def __init__(self):
         GstBase.BaseTransform.__init__(self)
 
         self._add_pts = False
         self._rotation = 0
+        self._max_latency = 0
+        self._dropped = 0
+        self._clock_offset = None
+        self._trace_file = None
+        self._trace = NULL_TRACE
+        self._push_start = None
+        self._trace_probes = []
+
+        # Lookup tables as [bank, eye]. _lut_bank is the published bank,
+        # _reading_bank the one the current frame uses. Updates go into the
+        # remaining bank, under _lut_lock.
+        self._gamma = 1.0
+        self._normalize = False
+        self._lut_active = False
+        self._luts = np.empty((self.LUT_BANKS, 2, 256), dtype=np.uint8)
+        self._luts[:] = np.arange(256, dtype=np.uint8)
+        self._lut_bank = 0
+        self._reading_bank = 0
+        self._lut_lock = threading.Lock()
+        self._user_luts = np.empty((2, 256), dtype=np.uint8)
+        self._user_luts[:] = np.arange(256, dtype=np.uint8)
+        self._user_lut_set = [False, False]
+        self._lut_work = np.empty(256, dtype=np.float32)
+        self._chunk_buf = np.empty(2400, dtype=np.uint8)
+        self._stats = np.array([[self.NORM_MEAN, self.NORM_STD]] * 2)
 
         self._last_buf = None
 
@@ -115,6 +239,16 @@ class XRealUltra2Dec(GstBase.BaseTransform):
             return self._add_pts
         elif prop.name == 'rotation':
             return self._rotation
+        elif prop.name == 'max-latency':
+            return self._max_latency
+        elif prop.name == 'dropped':
+            return self._dropped
+        elif prop.name == 'trace-file':
+            return self._trace_file
+        elif prop.name == 'gamma':
+            return self._gamma
+        elif prop.name == 'normalize':
+            return self._normalize
         else:
             raise AttributeError('unknown property %s' % prop.name)
 
@@ -124,6 +258,18 @@ class XRealUltra2Dec(GstBase.BaseTransform):
         elif prop.name == 'rotation':
             print("rotation:", value)
             self._rotation = value
+        elif prop.name == 'max-latency':
+            self._max_latency = value
+            self._clock_offset = None
+        elif prop.name == 'trace-file':
+            self._trace_file = value
+        elif prop.name == 'gamma':
+            self._gamma = value
+            self.update_tone_curves()
+        elif prop.name == 'normalize':
+            self._normalize = value
+            self._stats[:] = (self.NORM_MEAN, self.NORM_STD)
+            self.update_tone_curves()
         else:
             raise AttributeError('unknown property %s' % prop.name)
 
@@ -131,23 +277,135 @@ class XRealUltra2Dec(GstBase.BaseTransform):
     # create the pad with the correct caps.
     def do_transform_caps(self, direction, caps, filt):
         if direction == Gst.PadDirection.SINK:
-            if self._rotation != 2:
+            if self._rotation == 3:
+                return OCAPS_META
+            elif self._rotation != 2:
                 return OCAPS_HORIZ
             else:
                 return OCAPS_VERT
         else:
             return ICAPS
 
+    def do_start(self):
+        self._trace = trace_from_env('xrealultra2dec', self._trace_file)
+        if self._trace:
+            # There is no probe for the end of a push, so the span runs from
+            # our src pad to the next buffer entering our sink pad: downstream
+            # processing plus the wait for upstream. A blocking (IDLE) probe
+            # would stall the stream, only BUFFER probes are used.
+            srcpad = self.get_static_pad('src')
+            sinkpad = self.get_static_pad('sink')
+            self._trace_probes = [
+                (srcpad, srcpad.add_probe(Gst.PadProbeType.BUFFER, self.on_push_start)),
+                (sinkpad, sinkpad.add_probe(Gst.PadProbeType.BUFFER, self.on_push_end)),
+            ]
+        return True
+
+    def do_stop(self):
+        for pad, probe in self._trace_probes:
+            pad.remove_probe(probe)
+        self._trace_probes = []
+        self._trace.dump()
+        self._trace = NULL_TRACE
+        self._last_buf = None
+        return True
+
+    def on_push_start(self, pad, info):
+        self._push_start = self._trace.begin()
+        return Gst.PadProbeReturn.OK
+
+    def on_push_end(self, pad, info):
+        if self._push_start is not None:
+            self._trace.end('downstream+wait', self._push_start)
+            self._push_start = None
+        return Gst.PadProbeReturn.OK
+
+    def set_lut(self, eye, table):
+        # Install a custom 256 entry table for an eye (0: left, 1: right),
+        # applied after gamma/normalize. None goes back to the plain curve.
+        with self._lut_lock:
+            if table is None:
+                self._user_luts[eye] = np.arange(256, dtype=np.uint8)
+                self._user_lut_set[eye] = False
+            else:
+                self._user_luts[eye] = table
+                self._user_lut_set[eye] = True
+        self.update_tone_curves((eye,))
+
+    def tone_curve(self, eye):
+        work = self._lut_work
+        if self._normalize:
+            mean, std = self._stats[eye]
+            np.subtract(self.LUT_BASE, mean, out=work)
+            work *= self.NORM_STD / max(std, 1.0)
+            work += self.NORM_MEAN
+            np.clip(work, 0, 255, out=work)
+        else:
+            work[:] = self.LUT_BASE
+        if self._gamma != 1.0:
+            work /= 255
+            np.power(work, 1 / self._gamma, out=work)
+            work *= 255
+        np.rint(work, out=work)
+        return work
+
+    def update_tone_curves(self, eyes=(0, 1)):
+        with self._lut_lock:
+            active = self._normalize or self._gamma != 1.0 or any(self._user_lut_set)
+            if not active:
+                self._lut_active = False
+                return
+            if not self._lut_active:
+                # The banks were left alone while inactive, so refresh both
+                eyes = (0, 1)
+            # Neither the published bank nor the one a frame may still read
+            bank = next(b for b in range(self.LUT_BANKS)
+                        if b != self._lut_bank and b != self._reading_bank)
+            self._luts[bank] = self._luts[self._lut_bank]
+            for eye in eyes:
+                curve = self._luts[bank, eye]
+                np.copyto(curve, self.tone_curve(eye), casting='unsafe')
+                if self._user_lut_set[eye]:
+                    self._user_luts[eye].take(curve, out=curve)
+            self._lut_bank = bank
+            self._lut_active = True
+
+    def update_statistics(self, in_frame, eye):
+        # The statistics do not care about the chunk order, so sample the
+        # scrambled input directly.
+        sample = in_frame[:640*480:self.NORM_STRIDE]
+        stats = self._stats[eye]
+        stats += self.NORM_ALPHA * (np.array((sample.mean(), sample.std())) - stats)
+        self.update_tone_curves((eye,))
+
     def handle_frame(self, in_frame, np_out):
         blocks = in_frame[:640*480].reshape((128, 2400))
 
         # Slightly faster
         CHUNK_MAP = self.CHUNK_MAP
 
+        trace = self._trace
+
         # TODO: Figure out a better way to get the starting index
         # (at least this does not loop in python ...)
+        t = trace.begin()
         map_idx = blocks[:,:128].sum(axis=1).argmin()
         map_idx = CHUNK_MAP.index(map_idx)
+        trace.end('start-offset', t)
+
+        eye = 1 if in_frame[480*640 + 0x3b] else 0
+        if self._normalize:
+            self.update_statistics(in_frame, eye)
+        # Applied per chunk while it is hot in the cache, not as a second pass.
+        # The bank is pinned for the whole frame, updates go elsewhere.
+        lut = None
+        if self._lut_active:
+            with self._lut_lock:
+                bank = self._reading_bank = self._lut_bank
+            lut = self._luts[bank, eye]
+        chunk_buf = self._chunk_buf
+
+        t = trace.begin()
 
         if self._rotation == 2:
             out_img = np_out.reshape((480*2, 640), order='F')
@@ -168,6 +426,8 @@ class XRealUltra2Dec(GstBase.BaseTransform):
             p_x = 0
             for t_idx in range(128):
                 source = blocks[CHUNK_MAP[map_idx]]
+                if lut is not None:
+                    source = lut.take(source, out=chunk_buf, mode='clip')
 
                 pos = 0
                 while pos < 2400:
@@ -194,20 +454,59 @@ class XRealUltra2Dec(GstBase.BaseTransform):
                 if self._rotation == 1:
                     out = out[::-1]
 
-            for t_idx in range(128):
-                source = blocks[CHUNK_MAP[map_idx]]
-                out[t_idx * 2400:t_idx * 2400 + 2400] = source
-                map_idx = (map_idx + 1) % 128
-
-            pass
+            if out.flags.c_contiguous and lut is None:
+                # Gather all chunks in one go, writing the output linearly
+                order = np.roll(self.CHUNK_ORDER, -map_idx)
+                blocks.take(order, axis=0, out=out.reshape((128, 2400)), mode='clip')
+            elif out.flags.c_contiguous:
+                # Look up straight from the source chunk into the output
+                out_blocks = out.reshape((128, 2400))
+                for t_idx in range(128):
+                    lut.take(blocks[CHUNK_MAP[map_idx]], out=out_blocks[t_idx], mode='clip')
+                    map_idx = (map_idx + 1) % 128
+            else:
+                for t_idx in range(128):
+                    source = blocks[CHUNK_MAP[map_idx]]
+                    if lut is not None:
+                        source = lut.take(source, out=chunk_buf, mode='clip')
+                    out[t_idx * 2400:t_idx * 2400 + 2400] = source
+                    map_idx = (map_idx + 1) % 128
+
+        trace.end('descramble', t)
+
+    def frame_age(self, buf):
+        # Age of the frame relative to the freshest one seen so far. The
+        # smallest host - device difference is our best estimate of the clock
+        # offset (i.e. the frame that arrived with the least delay). TS2 is
+        # used as it is shared by both cameras, TS1 differs per camera and a
+        # single offset estimate would make one eye look permanently late.
+        host_ns = time.monotonic_ns()
+        device_ns = struct.unpack('<Q', buf.extract_dup(640*480 + 0x3e, 8))[0]
+        offset = host_ns - device_ns
+
+        if self._clock_offset is None:
+            self._clock_offset = offset
+        else:
+            self._clock_offset = min(offset, self._clock_offset + self.CLOCK_DRIFT_NS)
 
+        return offset - self._clock_offset
 
     def do_transform(self, inbuf, outbuf):
+        if self._max_latency and self.frame_age(inbuf) > self._max_latency:
+            # Anything we are still holding is even older, drop it as well so
+            # that we pick up again with the next fresh pair.
+            self._dropped += 1 if self._last_buf is None else 2
+            self._last_buf = None
+            return Gst.FlowReturn.CUSTOM_SUCCESS
+
+        trace = self._trace
+
         # Input as linear array
         if self._last_buf is None:
             self._last_buf = inbuf
             return Gst.FlowReturn.CUSTOM_SUCCESS
 
+        t = trace.begin()
         success, in1_map_info = self._last_buf.map(Gst.MapFlags.READ)
         assert success
         np_in1 = np.ndarray(
@@ -230,7 +529,9 @@ class XRealUltra2Dec(GstBase.BaseTransform):
             shape=(480 * 2 * 640),
             dtype=np.uint8,
             buffer=out_map_info.data)
+        trace.end('map', t)
 
+        t = trace.begin()
         # TS1: a nanosecnd accurate timestamp (differs per camera)
         ts1_ns = struct.unpack('<Q', in1_map_info.data[640*480:640*480 + 8])[0]
         # TS2: a microsecond accurate timestamp (same for both cameras)
@@ -241,7 +542,9 @@ class XRealUltra2Dec(GstBase.BaseTransform):
 
         if seq1 != seq2:
             self._last_buf = inbuf
+            trace.end('pairing', t)
             return Gst.FlowReturn.CUSTOM_SUCCESS
+        trace.end('pairing', t)
 
          # Add metadata to the buffer?
         if self._add_pts:
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# End-to-end throughput and latency harness for the xrealultra2dec chain.
+#
+# Usage
+#
+#   python3 scripts/pipeline_bench.py
+#   python3 scripts/pipeline_bench.py --decoder "xrealultra2dec rotation=2" \
+#       --downstream "videoconvert ! queue" --frames 1200 --output run.json
+#   python3 scripts/pipeline_bench.py --input capture.raw --fps 60 --compare run.json
+#
+# Scrambled frames (synthetic, or recorded with
+#   gst-launch-1.0 v4l2src device=/dev/videoX num-buffers=600 ! filesink location=capture.raw
+# ) are pushed through an appsrc into the real element and the downstream
+# stages, ending in a fakesink. Every src pad in the chain gets a probe, the
+# buffers are matched by PTS and the script reports sustained fps, p50/p99
+# latency per stage and end to end, and CPU time per output pair as JSON.
+#
+# The decoder is loaded from parts/xreal.py in this checkout (not from
+# GST_PLUGIN_PATH) so the numbers belong to the tree being benchmarked.
+
+import argparse
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import gi
+import numpy as np
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+Gst.init(None)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'parts'))
+import xreal
+
+Gst.Element.register(None, 'xrealultra2dec', Gst.Rank.NONE, xreal.XRealUltra2Dec)
+
+# What v4l2src delivers for the camera: 640x480 scrambled image + 2 header rows
+FRAME_SIZE = 640 * 482
+HEADER_OFFSET = 640 * 480
+INPUT_CAPS = 'video/x-raw,format=YUY2,width=640,height=241,framerate=%d/1'
+SYNTHETIC_PAIRS = 16 # Distinct synthetic pairs, cycled through during a run
+
+
+def make_scrambled_frame(image, eye, seq, start):
+    """Scramble a 480x640 GRAY8 image the way the camera does."""
+    frame = np.zeros(FRAME_SIZE, dtype=np.uint8)
+    blocks = frame[:HEADER_OFFSET].reshape((128, 2400))
+    blocks[np.roll(xreal.XRealUltra2Dec.CHUNK_ORDER, -start)] = image.reshape((128, 2400))
+    frame[HEADER_OFFSET + 18:HEADER_OFFSET + 20] = np.frombuffer(struct.pack('<h', seq), dtype=np.uint8)
+    frame[HEADER_OFFSET + 0x3b] = eye
+    return frame
+
+
+def synthetic_frames(count):
+    """Yield pairs of scrambled frames (left, right) with a moving gradient."""
+    y, x = np.mgrid[0:480, 0:640]
+    for i in range(count):
+        image = ((x + y + i * 4) % 224 + 16).astype(np.uint8)
+        # The decoder locates the first chunk as the darkest one
+        image.flat[:128] = 0
+        start = (i * 37) % 128
+        seq = i % 0x8000
+        right = image[::-1].copy()
+        right.flat[:128] = 0
+        yield make_scrambled_frame(image, 0, seq, start)
+        yield make_scrambled_frame(right, 1, seq, start)
+
+
+def recorded_frames(path):
+    data = np.fromfile(path, dtype=np.uint8)
+    count = len(data) // FRAME_SIZE
+    if count == 0:
+        raise SystemExit(f"ERROR: {path} does not contain a single {FRAME_SIZE} byte frame")
+    return data[:count * FRAME_SIZE].reshape((count, FRAME_SIZE))
+
+
+def percentiles(values_ns):
+    if not values_ns:
+        return None
+    values = np.asarray(values_ns, dtype=np.float64) / 1e6
+    return {
+        'count': len(values),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageRecorder:
+    """Timestamps every buffer at each src pad of the chain, keyed by PTS."""
+
+    def __init__(self):
+        self.stages = ['push']
+        self.stamps = {'push': {}}
+        self._lock = threading.Lock()
+
+    def attach(self, pad, name):
+        self.stages.append(name)
+        self.stamps[name] = {}
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._on_buffer, name)
+
+    def _on_buffer(self, pad, info, name):
+        now = time.perf_counter_ns()
+        buf = info.get_buffer()
+        with self._lock:
+            self.stamps[name][buf.pts] = now
+        return Gst.PadProbeReturn.OK
+
+    def mark_push(self, pts):
+        self.stamps['push'][pts] = time.perf_counter_ns()
+
+
+def build_pipeline(args, recorder):
+    desc = 'appsrc name=src ! %s' % args.decoder
+    if args.downstream:
+        desc += ' ! %s' % args.downstream
+    desc += ' ! fakesink name=sink sync=false'
+    pipeline = Gst.parse_launch(desc)
+
+    src = pipeline.get_by_name('src')
+    src.props.caps = Gst.Caps.from_string(INPUT_CAPS % (args.fps or 60))
+    src.props.format = Gst.Format.TIME
+    src.props.is_live = args.fps > 0
+    src.props.block = True
+    src.props.max_bytes = FRAME_SIZE * 4
+
+    # Walk the (linear) chain and probe every element's output
+    pad = src.get_static_pad('src')
+    while pad is not None:
+        peer = pad.get_peer()
+        if peer is None:
+            break
+        element = peer.get_parent_element()
+        pad = element.get_static_pad('src')
+        if pad is not None:
+            recorder.attach(pad, element.get_name())
+        else:
+            recorder.attach(peer, element.get_name())
+
+    return pipeline, src
+
+
+def run(args):
+    recorder = StageRecorder()
+    pipeline, src = build_pipeline(args, recorder)
+
+    # Frames are prepared up front and cycled, so synthesizing them does not
+    # eat into the measured throughput. The header is restamped in place.
+    if args.input:
+        pool = recorded_frames(args.input)
+    else:
+        pool = list(synthetic_frames(SYNTHETIC_PAIRS))
+    frames = (pool[i % len(pool)] for i in range(args.frames))
+
+    bus = pipeline.get_bus()
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        raise SystemExit("ERROR: Pipeline failed to go to PLAYING state.")
+
+    frame_ns = 1000000000 // (args.fps or 60)
+    feeder_cpu = 0.0
+    pushed = 0
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter_ns()
+    while True:
+        # Preparing the buffer is harness work, keep it out of the CPU time
+        # attributed to the pipeline.
+        t_cpu = time.thread_time()
+        frame = next(frames, None)
+        if frame is None:
+            feeder_cpu += time.thread_time() - t_cpu
+            break
+        # Restamp with the host clock, the decoder may compare against it. TS1
+        # differs per camera, TS2 is shared by both eyes of a pair.
+        now = time.monotonic_ns()
+        if pushed % 2 == 0:
+            pair_ts = now
+        frame[HEADER_OFFSET:HEADER_OFFSET + 8] = np.frombuffer(
+            struct.pack('<Q', now), dtype=np.uint8)
+        frame[HEADER_OFFSET + 0x3e:HEADER_OFFSET + 0x46] = np.frombuffer(
+            struct.pack('<Q', pair_ts), dtype=np.uint8)
+        buf = Gst.Buffer.new_wrapped(frame.tobytes())
+        buf.pts = pushed * frame_ns
+        buf.duration = frame_ns
+        feeder_cpu += time.thread_time() - t_cpu
+
+        if args.fps:
+            delay = wall_start + pushed * frame_ns - time.perf_counter_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+
+        recorder.mark_push(buf.pts)
+        if src.emit('push-buffer', buf) != Gst.FlowReturn.OK:
+            break
+        pushed += 1
+
+    src.emit('end-of-stream')
+    msg = bus.timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    wall_end = time.perf_counter_ns()
+    cpu_end = time.process_time()
+    pipeline.set_state(Gst.State.NULL)
+
+    if msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise SystemExit(f"ERROR: {err}, {debug}")
+
+    return summarize(args, recorder, pushed, frame_ns,
+                     wall_end - wall_start, cpu_end - cpu_start - feeder_cpu)
+
+
+def summarize(args, recorder, pushed, frame_ns, wall_ns, cpu_s):
+    stamps = recorder.stamps
+    last = stamps[recorder.stages[-1]]
+    pairs = len(last)
+
+    stages = {}
+    for prev, cur in zip(recorder.stages, recorder.stages[1:]):
+        deltas = [t - stamps[prev][pts] for pts, t in stamps[cur].items() if pts in stamps[prev]]
+        stages[cur] = percentiles(deltas)
+
+    # A pair is only complete once its second eye arrived, but its age counts
+    # from the first eye entering the pipeline.
+    push = stamps['push']
+    end_to_end = [t - push[pts - frame_ns] for pts, t in last.items() if pts - frame_ns in push]
+
+    return {
+        'revision': git_revision(),
+        'label': args.label,
+        'config': {
+            'decoder': args.decoder,
+            'downstream': args.downstream,
+            'input': args.input or 'synthetic',
+            'fps': args.fps,
+            'frames': pushed,
+        },
+        'pairs_out': pairs,
+        'wall_s': wall_ns / 1e9,
+        'fps': pairs / (wall_ns / 1e9) if wall_ns else 0.0,
+        'cpu_ms_per_pair': cpu_s * 1e3 / pairs if pairs else None,
+        'stages': stages,
+        'end_to_end': percentiles(end_to_end),
+    }
+
+
+def compare(result, baseline):
+    def fmt(name, new, old, higher_is_better=False):
+        if new is None or old is None:
+            return
+        change = (new - old) / old * 100 if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        print(f"  {name:<32} {old:10.3f} -> {new:10.3f} ({change:+.1f}%{', better' if better else ''})")
+
+    print(f"Comparing against {baseline.get('revision')} ({baseline.get('label')}):")
+    fmt('fps', result['fps'], baseline['fps'], higher_is_better=True)
+    fmt('cpu_ms_per_pair', result['cpu_ms_per_pair'], baseline['cpu_ms_per_pair'])
+    for key in ('p50_ms', 'p99_ms'):
+        if result['end_to_end'] and baseline['end_to_end']:
+            fmt('end_to_end ' + key, result['end_to_end'][key], baseline['end_to_end'][key])
+        for stage, stats in result['stages'].items():
+            old = baseline['stages'].get(stage)
+            if stats and old:
+                fmt(f'{stage} {key}', stats[key], old[key])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure throughput and latency of the xrealultra2dec pipeline")
+    parser.add_argument('--decoder', default='xrealultra2dec rotation=2',
+                        help="decoder element and properties (do not set pts-from-frame, "
+                             "buffers are matched by PTS)")
+    parser.add_argument('--downstream', default='videoconvert',
+                        help="downstream stages in gst-launch syntax, may be empty")
+    parser.add_argument('--input', help="raw scrambled frames recorded from v4l2src")
+    parser.add_argument('--frames', type=int, default=1200, help="number of input frames")
+    parser.add_argument('--fps', type=int, default=0,
+                        help="input rate for latency runs, 0 pushes as fast as possible")
+    parser.add_argument('--label', help="free-form label stored with the results")
+    parser.add_argument('--output', help="write JSON results to this file")
+    parser.add_argument('--compare', help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()